@@ -9,7 +9,11 @@ Options:
 from datetime import date
 
 from docopt import docopt
-import matplotlib.pyplot as plt
+import matplotlib
+
+matplotlib.use("Agg")  # Before seaborn imports pyplot, we only render to files
+
+from matplotlib.figure import Figure
 import pandas as pd
 import seaborn as sns
 import tweepy
@@ -17,10 +21,15 @@ import tweepy
 from basketball_reference_scraper.constants import TEAM_TO_TEAM_ABBR as TEAM2ABBR
 from basketball_reference_scraper.seasons import get_schedule, get_standings
 from basketball_reference_scraper.injury_report import get_injury_report
-from basketball_reference_scraper.utils import remove_accents
 
 from credentials import API_KEY, API_SECRET_KEY, ACCESS_TOKEN, ACCESS_TOKEN_SECRET
-from nba_game_plots import shorten, red, blue
+from nba_game_plots import (
+    SCHEDULE_COLUMNS,
+    add_ascii_players,
+    shorten_injured,
+    red,
+    blue,
+)
 
 
 auth = tweepy.OAuthHandler(API_KEY, API_SECRET_KEY)
@@ -29,57 +38,62 @@ API = tweepy.API(auth)
 
 year = date.today().year
 standings = get_standings()
-schedule = get_schedule(year)
-injury_report = get_injury_report()
+schedule = get_schedule(year)[SCHEDULE_COLUMNS]
+injury_report = add_ascii_players(get_injury_report())
+injuries_by_team = dict(list(injury_report.groupby("TEAM")))
+no_injuries = injury_report.iloc[:0]
+
+schedule = schedule.assign(
+    away_win=schedule.eval("VISITOR_PTS > HOME_PTS"),
+    home_win=schedule.eval("VISITOR_PTS < HOME_PTS"),
+).set_index("DATE")
+away_wins = dict(list(schedule.groupby("VISITOR")["away_win"]))
+home_wins = dict(list(schedule.groupby("HOME")["home_win"]))
+
+fig = Figure(figsize=[5.05, 2.85])
+ax = fig.subplots()
 
 for conference_standings in standings.values():
     api_reply = None
     for team in conference_standings.iloc[:10].itertuples():
         team_abbr = TEAM2ABBR[team.TEAM.upper()]
-        injuries = injury_report.query(f"TEAM == '{team_abbr}'")
+        injuries = injuries_by_team.get(team_abbr, no_injuries)
         if len(injuries):
+            players = shorten_injured(injuries, team_abbr, year)
             status = "\n".join(
-                injuries.apply(
-                    lambda injury: " ".join(
-                        [
-                            shorten(remove_accents(injury.PLAYER, team_abbr, year)),
-                            injury.STATUS,
-                            str(injury.DATE.date()),
-                            injury.INJURY,
-                        ]
-                    ),
-                    axis=1,
-                )
+                players
+                + " "
+                + injuries["STATUS"]
+                + " "
+                + injuries["DATE"].dt.strftime("%Y-%m-%d")
+                + " "
+                + injuries["INJURY"]
             )
         else:
             status = ""
 
-        games = pd.concat(
-            [
-                schedule.query(f"VISITOR == '{team.TEAM}'")
-                .set_index("DATE")
-                .eval("VISITOR_PTS > HOME_PTS"),
-                schedule.query(f"HOME == '{team.TEAM}'")
-                .set_index("DATE")
-                .eval("VISITOR_PTS < HOME_PTS"),
-            ]
-        ).sort_index()
-
-        plt.figure(figsize=[5.05, 2.85])
-        games.cumsum().plot(color=blue)
-        plt.vlines(
+        games = pd.concat([away_wins[team.TEAM], home_wins[team.TEAM]]).sort_index()
+
+        ax.clear()
+        games.cumsum().plot(ax=ax, color=blue)
+        ax.vlines(
             injuries[injuries["DATE"] > games.index.min()].DATE,
             0,
             games.sum(),
             color=red,
             linestyle=":",
         )
-        sns.despine()
-        plt.xlabel("")
-        plt.title(f"{team.Index + 1}. {team.TEAM}, {games.sum()} in {len(games)}")
-        plt.savefig("season.png", transparent=False, dpi=300)
+        sns.despine(fig=fig)
+        ax.set_xlabel("")
+        ax.set_title(f"{team.Index + 1}. {team.TEAM}, {games.sum()} in {len(games)}")
+        fig.savefig(
+            "season.jpg",
+            transparent=False,
+            dpi=150,
+            pil_kwargs={"quality": 85, "optimize": True},
+        )
 
-        media = API.media_upload("season.png")
+        media = API.media_upload("season.jpg")
         api_reply = API.update_status(
             status[:279],
             media_ids=[media.media_id],
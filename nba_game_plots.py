@@ -10,14 +10,23 @@ Options:
                     about the new games of the last three days is tweeted.
   -h --help         Show this screen.
 """
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import lru_cache
+from io import BytesIO
 from itertools import product
 from time import sleep
 
 from docopt import docopt
-import matplotlib.pyplot as plt
+import matplotlib
+
+matplotlib.use("Agg")  # Before seaborn imports pyplot, we only render to files
+
+from matplotlib.figure import Figure
 from matplotlib.patches import Arc, Circle, Rectangle
 import numpy as np
 import pandas as pd
+import requests_cache
 import seaborn as sns
 import tweepy
 
@@ -45,6 +54,8 @@ auth = tweepy.OAuthHandler(API_KEY, API_SECRET_KEY)
 auth.set_access_token(ACCESS_TOKEN, ACCESS_TOKEN_SECRET)
 API = tweepy.API(auth)
 
+SCHEDULE_COLUMNS = ["DATE", "VISITOR", "HOME", "VISITOR_PTS", "HOME_PTS"]
+
 blue = "#1d428a"
 red = "#c8102e"
 
@@ -56,7 +67,90 @@ def shorten(name):
     return " ".join([first] + last)
 
 
-def tweet_game(game, injury_report):
+def add_ascii_players(injury_report):
+    return injury_report.assign(
+        PLAYER_ASCII=injury_report["PLAYER"]
+        .str.normalize("NFKD")
+        .str.encode("ascii", "ignore")
+        .str.decode("ascii")
+    )
+
+
+def shorten_injured(injuries, team, year):
+    # Only names with accents need remove_accents to look up the player's spelling
+    players = injuries["PLAYER_ASCII"].copy()
+    has_accents = players.ne(injuries["PLAYER"])
+    players[has_accents] = injuries.loc[has_accents, "PLAYER"].map(
+        lambda player: remove_accents(player, team, year)
+    )
+    return players.map(shorten)
+
+
+def draw_court(ax):
+    ax.add_artist(Circle((47, 25), 6, fc="none", ec="k", lw=1))
+    ax.plot([47, 47], [0, 50], lw=1, c="k")
+
+    ax.add_artist(Circle((5.25, 25), 1.5, fc="none", ec="k", lw=1))
+    ax.plot([0, 14], [3, 3], lw=1, c="k")
+    ax.plot([0, 14], [47, 47], lw=1, c="k")
+    ax.add_artist(Arc((5.25, 25), 47.5, 47.5, theta1=292, theta2=68, fc="none", lw=1))
+    ax.add_artist(Rectangle((0, 17), 19, 16, lw=1, ec="k", fill=False))
+
+    ax.add_artist(Circle((88.75, 25), 1.5, fc="none", ec="k", lw=1))
+    ax.plot([80, 94], [3, 3], lw=1, c="k")
+    ax.plot([80, 94], [47, 47], lw=1, c="k")
+    ax.add_artist(Arc((88.75, 25), 47.5, 47.5, theta1=112, theta2=249, fc="none", lw=1))
+    ax.add_artist(Rectangle((77, 17), 19, 16, lw=1, ec="k", fill=False))
+
+    ax.set_aspect("equal")
+    ax.set_xlim(0, 94)
+    ax.set_ylim(0, 50)
+    ax.set_xticks([])
+    ax.set_yticks([])
+
+
+# Figures are reused for all games, they are only ever drawn on by one thread at a time
+@lru_cache()
+def scores_figure():
+    fig = Figure(figsize=[5.05, 2.85])
+    return fig, fig.subplots()
+
+
+@lru_cache()
+def shots_figure():
+    fig = Figure(figsize=[5.05, 2.85])
+    ax = fig.subplots()
+    draw_court(ax)
+    return fig, ax
+
+
+def cache_scraped_pages():
+    # Cache the play by play and shot chart pages of finished games, and the box score
+    # widgets, to spare Basketball Reference's rate limit. Everything else, like
+    # schedules, the injury report widget, the day pages linking to the games, and
+    # Twitter, changes over time and is never cached.
+    requests_cache.install_cache(
+        "bref_cache",
+        backend="sqlite",
+        urls_expire_after={
+            "*basketball-reference.com/boxscores/pbp/*": timedelta(hours=6),
+            "*basketball-reference.com/boxscores/shot-chart/*": timedelta(hours=6),
+            "*widgets.sports-reference.com/wg.fcgi*url=%2Fboxscores%2F2*": timedelta(
+                hours=6
+            ),
+            "*": requests_cache.DO_NOT_CACHE,
+        },
+        allowable_methods=("GET",),
+        filter_fn=lambda response: "api.twitter.com" not in response.url,
+    )
+
+
+@lru_cache()
+def screen_name():
+    return API.me().screen_name
+
+
+def prepare_game(game, injuries_by_team, no_injuries):
     # Title
     date = game.DATE.date()
     away_team = game.VISITOR
@@ -67,7 +161,7 @@ def tweet_game(game, injury_report):
     home_score = int(game.HOME_PTS)
     game_status = f"#{away_abbr}vs{home_abbr} {away_score}:{home_score} on {date}"
 
-    if API.search(f"from:{API.me().screen_name} '{game_status}'"):
+    if API.search(f"from:{screen_name()} '{game_status}'"):
         # This is not waterproof: It takes ~20s until a new tweet can be found. If the
         # app is run meanwhile, it will tweet again 🤷
         print(f"{game_status} already tweeted")
@@ -85,6 +179,9 @@ def tweet_game(game, injury_report):
         "away_score",
         "home_score",
     ]
+    play_by_play = play_by_play[
+        ["quarter", "time_remaining", "away_score", "home_score"]
+    ].astype({"away_score": "int16", "home_score": "int16"})
 
     game_status += "\nTies: {}\n".format(
         play_by_play.drop_duplicates(subset=["away_score", "home_score"])
@@ -100,9 +197,10 @@ def tweet_game(game, injury_report):
         play_by_play["lead"].abs().max(),
     )
 
-    play_by_play["remaining_seconds_in_period"] = play_by_play["time_remaining"].apply(
-        lambda time: int(time.split(":")[0]) * 60 + float(time.split(":")[1])
-    )
+    minutes_seconds = play_by_play["time_remaining"].str.split(":", n=1, expand=True)
+    play_by_play["remaining_seconds_in_period"] = minutes_seconds[0].astype(
+        int
+    ) * 60 + minutes_seconds[1].astype(float)
     play_by_play["time"] = (
         np.minimum(play_by_play["remaining_seconds_in_period"].diff(), 0)
         .cumsum()
@@ -129,12 +227,13 @@ def tweet_game(game, injury_report):
     )
 
     # Plot scores over time
-    plt.figure(figsize=[5.05, 2.85])
+    fig, ax = scores_figure()
+    ax.clear()
     for team, score, score_column, color in [
         (away_team, away_score, "away_score", blue),
         (home_team, home_score, "home_score", red),
     ]:
-        plt.plot(
+        ax.plot(
             play_by_play["time"],
             play_by_play[score_column],
             label=team + ", " + str(score),
@@ -146,23 +245,30 @@ def tweet_game(game, injury_report):
         for pause in [12, 24, 36, 48, 53, 58, 63, 68, 73, 78, 83]
         if pause < play_by_play["time"].max()
     ]
-    pause_play_by_play = [
-        play_by_play.query(f"time < {pause}")[["home_score", "away_score"]].max().max()
-        for pause in pauses
+    max_scores = np.maximum.accumulate(
+        play_by_play[["home_score", "away_score"]].max(axis=1).to_numpy()
+    )
+    pause_play_by_play = max_scores[
+        np.searchsorted(play_by_play["time"].to_numpy(), pauses, side="left") - 1
     ]
-    plt.vlines(pauses, 0, pause_play_by_play, colors="0.8", linestyles=":")
-
-    plt.title(date)
-    plt.legend(frameon=False)
-    plt.xlabel("Minutes")
-    plt.ylabel("Points")
-    plt.xlim(left=0)
-    plt.ylim(bottom=0)
-    sns.despine()
-    plt.tight_layout()
-    plt.savefig("scores.png", transparent=False, dpi=300)
-    media = API.media_upload("scores.png")
-    api_reply = API.update_status(game_status[:279], media_ids=[media.media_id])
+    ax.vlines(pauses, 0, pause_play_by_play, colors="0.8", linestyles=":")
+
+    ax.set_title(date)
+    ax.legend(frameon=False)
+    ax.set_xlabel("Minutes")
+    ax.set_ylabel("Points")
+    ax.set_xlim(left=0)
+    ax.set_ylim(bottom=0)
+    sns.despine(fig=fig)
+    fig.tight_layout()
+    scores_jpg = BytesIO()
+    fig.savefig(
+        scores_jpg,
+        format="jpg",
+        transparent=False,
+        dpi=150,
+        pil_kwargs={"quality": 85, "optimize": True},
+    )
 
     # Team stats
     try:
@@ -202,146 +308,111 @@ def tweet_game(game, injury_report):
 
     shots[away_abbr]["TEAM"] = away_abbr
     shots[home_abbr]["TEAM"] = home_abbr
-    shots = shots[away_abbr].append(shots[home_abbr])
-    shots["x"] = shots["x"].apply(lambda ft: float(ft[:-3]))
-    shots["y"] = shots["y"].apply(lambda ft: float(ft[:-3]))
+    shots = pd.concat([shots[away_abbr], shots[home_abbr]])[
+        ["x", "y", "VALUE", "MAKE_MISS", "TEAM"]
+    ]
+    shots["x"] = shots["x"].str[:-3].astype("float32")
+    shots["y"] = shots["y"].str[:-3].astype("float32")
 
     # Unfortunately the coordinates suck, so we shift and scale them around to make sure
     # all threes are from behind the ark.
     left_corner = shots.query("VALUE == 3 and y < 14 and x < 25")["x"].max()
     right_corner = shots.query("VALUE == 3 and y < 14 and x > 25")["x"].min()
     if left_corner and right_corner:
-        shots["x"] = shots["x"] - left_corner
-        shots["x"] = shots["x"] / (right_corner - left_corner) * 44
-        shots["x"] = shots["x"] + 3
+        shots["x"] = (shots["x"].to_numpy() - left_corner) * (
+            44 / (right_corner - left_corner)
+        ) + 3
     behind_ark = shots.query("VALUE == 3 and y > 14")
     min_dist = np.sqrt(
-        (behind_ark["x"] - 25) ** 2 + (behind_ark["y"] - 5.25) ** 2
-    ).min()
+        ((behind_ark["x"] - 25) ** 2 + (behind_ark["y"] - 5.25) ** 2).min()
+    )
     shots["y"] = shots["y"] / min_dist * 23.75
 
-    plt.figure(figsize=[5.05, 2.85])
-    plt.title(f"{away_team} {away_score}:{home_score} {home_team}")
+    fig, ax = shots_figure()
+    for previous_shots in list(ax.collections):
+        previous_shots.remove()
+    ax.set_title(f"{away_team} {away_score}:{home_score} {home_team}")
+    is_away = shots["TEAM"].eq(away_abbr)
+    is_home = shots["TEAM"].eq(home_abbr)
     for make_miss, marker in [
         ("MAKE", "o"),
         ("MISS", "x"),
     ]:
-        plt.scatter(
-            shots.query(f"TEAM == '{away_abbr}' and MAKE_MISS == '{make_miss}'")["y"],
-            shots.query(f"TEAM == '{away_abbr}' and MAKE_MISS == '{make_miss}'")["x"],
+        is_make_miss = shots["MAKE_MISS"].eq(make_miss)
+        away_shots = shots.loc[is_away & is_make_miss, ["x", "y"]]
+        home_shots = shots.loc[is_home & is_make_miss, ["x", "y"]]
+        ax.scatter(
+            away_shots["y"],
+            away_shots["x"],
             marker=marker,
             ec=blue,
             fc="none",
         )
-        plt.scatter(
-            94
-            - shots.query(f"TEAM == '{home_abbr}' and MAKE_MISS == '{make_miss}'")["y"],
-            50
-            - shots.query(f"TEAM == '{home_abbr}' and MAKE_MISS == '{make_miss}'")["x"],
+        ax.scatter(
+            94 - home_shots["y"],
+            50 - home_shots["x"],
             marker=marker,
             ec=red,
             fc="none",
         )
 
-    plt.gca().add_artist(Circle((47, 25), 6, fc="none", ec="k", lw=1))
-    plt.plot([47, 47], [0, 50], lw=1, c="k")
-
-    plt.gca().add_artist(Circle((5.25, 25), 1.5, fc="none", ec="k", lw=1))
-    plt.plot([0, 14], [3, 3], lw=1, c="k")
-    plt.plot([0, 14], [47, 47], lw=1, c="k")
-    plt.gca().add_artist(
-        Arc((5.25, 25), 47.5, 47.5, theta1=292, theta2=68, fc="none", lw=1)
-    )
-    plt.gca().add_artist(Rectangle((0, 17), 19, 16, lw=1, ec="k", fill=False))
-
-    plt.gca().add_artist(Circle((88.75, 25), 1.5, fc="none", ec="k", lw=1))
-    plt.plot([80, 94], [3, 3], lw=1, c="k")
-    plt.plot([80, 94], [47, 47], lw=1, c="k")
-    plt.gca().add_artist(
-        Arc((88.75, 25), 47.5, 47.5, theta1=112, theta2=249, fc="none", lw=1)
-    )
-    plt.gca().add_artist(Rectangle((77, 17), 19, 16, lw=1, ec="k", fill=False))
-
-    plt.gca().set_aspect("equal")
-    plt.xlim(0, 94)
-    plt.ylim(0, 50)
-    plt.xticks([])
-    plt.yticks([])
-    plt.tight_layout()
-    plt.savefig("shots.png", transparent=False, dpi=300)
-    media = API.media_upload("shots.png")
-    api_reply = API.update_status(
-        teams_status[:279],
-        media_ids=[media.media_id],
-        in_reply_to_status_id=api_reply.id_str,
+    fig.tight_layout()
+    shots_png = BytesIO()
+    fig.savefig(
+        shots_png,
+        format="png",
+        transparent=False,
+        dpi=150,
+        pil_kwargs={"optimize": True},
     )
 
     # Best individual stats
+    players_status = None
     if box_scores:
         stats = ["PTS", "TRB", "AST", "STL", "BLK"]
-        box_scores = (
-            pd.concat(box_scores.values())
-            .query("PLAYER != 'Team Totals'")
-            .set_index("PLAYER")
+        box_scores = pd.concat(box_scores.values(), copy=False)
+        box_scores = box_scores[box_scores["PLAYER"].ne("Team Totals")].set_index(
+            "PLAYER"
         )
         box_scores = box_scores[
-            ~box_scores["MP"].str.contains("Not")
-            & ~box_scores["MP"].str.contains("Suspended")
-        ].astype({stat: int for stat in stats})
+            ~box_scores["MP"].str.contains("Not|Suspended", regex=True, na=False)
+        ].astype({stat: "int16" for stat in stats})
 
         players_status = ""
         for stat in stats:
+            best = box_scores.nlargest(3, stat)
             players_status += (
                 f"{stat}: "
-                + ", ".join(
-                    box_scores.sort_values(stat, ascending=False)
-                    .iloc[:3]
-                    .apply(
-                        lambda player: f"{shorten(player.name)} {player[stat]}", axis=1
-                    )
-                )
+                + ", ".join(best.index.map(shorten) + " " + best[stat].astype(str))
                 + "\n"
             )
-        api_reply = API.update_status(
-            players_status[:279], in_reply_to_status_id=api_reply.id_str
-        )
 
     # Injury report
     injury_stati = []
+    game_day = pd.Timestamp(date)
     for team in [away_abbr, home_abbr]:
-        team_injuries = injury_report[
-            (injury_report["DATE"] <= pd.to_datetime(date))
-            & (injury_report["TEAM"] == team)
-        ]
+        team_injuries = injuries_by_team.get(team, no_injuries)
+        team_injuries = team_injuries.iloc[
+            : team_injuries["DATE"].searchsorted(game_day, side="right")
+        ].sort_index()  # Back to the report's order
         if len(team_injuries):
+            players = shorten_injured(team_injuries, team, date.year)
             injury_stati.append(
                 team
                 + ":\n"
                 + "\n".join(
-                    team_injuries.apply(
-                        lambda injury: " ".join(
-                            [
-                                shorten(remove_accents(injury.PLAYER, team, date.year)),
-                                injury.STATUS,
-                                str(injury.DATE.date()),
-                                injury.INJURY,
-                            ]
-                        ),
-                        axis=1,
-                    )
+                    players
+                    + " "
+                    + team_injuries["STATUS"]
+                    + " "
+                    + team_injuries["DATE"].dt.strftime("%Y-%m-%d")
+                    + " "
+                    + team_injuries["INJURY"]
                 )
             )
-    if not injury_stati:
-        return
-
     if len(injury_stati) == 2 and len(injury_stati[0]) + len(injury_stati[1]) <= 278:
         injury_stati = [injury_stati[0] + "\n" + injury_stati[1]]
 
-    for status in injury_stati:
-        api_reply = API.update_status(
-            status[:279], in_reply_to_status_id=api_reply.id_str
-        )
-
     # Link to Basketball Reference
     link_to_source = (
         "\nSource & more data: "
@@ -349,27 +420,74 @@ def tweet_game(game, injury_report):
             date.year, date.month, date.day, TEAM2ABBR[home_team.upper()]
         )
     )
+
+    return {
+        "game_status": game_status,
+        "scores_jpg": scores_jpg,
+        "teams_status": teams_status,
+        "shots_png": shots_png,
+        "players_status": players_status,
+        "injury_stati": injury_stati,
+        "link_to_source": link_to_source,
+    }
+
+
+def post_game(prepared):
+    prepared["scores_jpg"].seek(0)
+    media = API.media_upload("scores.jpg", file=prepared["scores_jpg"])
+    api_reply = API.update_status(
+        prepared["game_status"][:279], media_ids=[media.media_id]
+    )
+
+    prepared["shots_png"].seek(0)
+    media = API.media_upload("shots.png", file=prepared["shots_png"])
+    api_reply = API.update_status(
+        prepared["teams_status"][:279],
+        media_ids=[media.media_id],
+        in_reply_to_status_id=api_reply.id_str,
+    )
+
+    if prepared["players_status"]:
+        api_reply = API.update_status(
+            prepared["players_status"][:279], in_reply_to_status_id=api_reply.id_str
+        )
+
+    if not prepared["injury_stati"]:
+        return
+
+    for status in prepared["injury_stati"]:
+        api_reply = API.update_status(
+            status[:279], in_reply_to_status_id=api_reply.id_str
+        )
+
     api_reply = API.update_status(
-        link_to_source[:279], in_reply_to_status_id=api_reply.id_str
+        prepared["link_to_source"][:279], in_reply_to_status_id=api_reply.id_str
     )
 
 
 if __name__ == "__main__":
     arguments = docopt(__doc__)
+    cache_scraped_pages()
 
     if arguments["--date"]:
         date = pd.to_datetime(arguments["--date"])
     else:
         date = pd.Timestamp.today()
 
-    schedule = pd.DataFrame()
+    schedules = []
     for year, playoffs in product([date.year, date.year + 1], [False, True]):
         try:
-            schedule = schedule.append(get_schedule(year, playoffs=playoffs).dropna())
+            schedules.append(
+                get_schedule(year, playoffs=playoffs).dropna()[SCHEDULE_COLUMNS]
+            )
             sleep(30)
 
         except ValueError:
             break  # No schedule available yet
+    if schedules:
+        schedule = pd.concat(schedules, ignore_index=True)
+    else:
+        schedule = pd.DataFrame(columns=SCHEDULE_COLUMNS)
 
     if arguments["--date"]:
         games = schedule.query(f"DATE == '{date.date()}'")
@@ -380,8 +498,20 @@ if __name__ == "__main__":
         print(f"No games on {date.date()}")
         exit()
 
-    injury_report = get_injury_report()
+    # Sorted by date for searchsorted in prepare_game, keeps the report's index
+    injury_report = add_ascii_players(get_injury_report()).sort_values(
+        "DATE", kind="mergesort"
+    )
+    injuries_by_team = dict(list(injury_report.groupby("TEAM")))
+    no_injuries = injury_report.iloc[:0]
     sleep(3)
 
-    for game in games.itertuples():
-        tweet_game(game, injury_report)
+    # Basketball Reference limits scrapping, so a single worker prepares the next game
+    # while the current one is tweeted.
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        for prepared in executor.map(
+            lambda game: prepare_game(game, injuries_by_team, no_injuries),
+            games.itertuples(),
+        ):
+            if prepared:
+                post_game(prepared)